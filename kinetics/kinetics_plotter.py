@@ -5,7 +5,7 @@ import matplotlib.pyplot as plt
 from pathlib import Path
 import argparse
 
-def main(master_summary_path: Path, output_dir: Path, plots_dir: Path):
+def main(master_summary_path: Path, output_dir: Path, plots_dir: Path, fmt: str = 'csv'):
     """
     Main function to analyze simulation data and generate plots.
 
@@ -13,6 +13,7 @@ def main(master_summary_path: Path, output_dir: Path, plots_dir: Path):
         master_summary_path (Path): Path to the master simulation summary CSV file.
         output_dir (Path): Directory to save analysis results.
         plots_dir (Path): Directory to save generated plots.
+        fmt (str): File format of the saved result tables, 'csv' or 'parquet'.
     """
     # --- ADDED: Define and create an output directory for the results ---
     output_dir.mkdir(parents=True, exist_ok=True)
@@ -28,61 +29,44 @@ def main(master_summary_path: Path, output_dir: Path, plots_dir: Path):
         print(f"Error: Master summary file not found at {master_summary_path}")
         exit()
 
-    # Initialize DataFrames to store results
+    # --- Aggregate every metric per simulation type (System) in one groupby pass ---
+    # Zero entries mark missing/failed runs, so they are masked out (NaN) and
+    # skipped by the reductions, as are genuine NaN values.
+    metric_columns = ['SHOOT1 prob', 'SHOOT2 prob', 'SHOOT3 prob', 'rate']
+    masked_columns = ['Flux value'] + metric_columns
+    masked_df = master_df.copy()
+    masked_df[masked_columns] = masked_df[masked_columns].mask(lambda x: x == 0)
+    masked_df['inv_flux'] = 1 / masked_df['Flux value']
+    stats_df = (
+        masked_df.groupby('System', sort=False)[['inv_flux'] + metric_columns]
+        .agg(['mean', 'sem'])
+        .rename_axis(None)
+    )
+
     columns = ['Mean', 'SEM']
-    flux_df = pd.DataFrame(columns=columns)
-    shoot1_df = pd.DataFrame(columns=columns)
-    shoot2_df = pd.DataFrame(columns=columns)
-    shoot3_df = pd.DataFrame(columns=columns)
-    rate_df = pd.DataFrame(columns=columns)
-
-    # Iterate through each unique simulation type (System)
-    simulation_types = master_df['System'].unique()
-
-    for simulation_type in simulation_types:
-        system_data = master_df[master_df['System'] == simulation_type].copy()
-
-        # --- Process Flux values (1/FLUX) ---
-        # Filter out zero flux values before calculating 1/flux
-        flux_values_nonzero = system_data[system_data['Flux value'] != 0]['Flux value']
-        if len(flux_values_nonzero) > 0:
-            inv_flux_values = 1 / flux_values_nonzero
-            flux_mean = np.mean(inv_flux_values)
-            flux_sem = np.std(inv_flux_values) / np.sqrt(len(inv_flux_values)) if len(inv_flux_values) > 1 else np.nan
-        else:
-            flux_mean = np.nan
-            flux_sem = np.nan
-        flux_df.loc[simulation_type] = [flux_mean, flux_sem]
-
-        # --- Process SHOOT probabilities ---
-        for shoot_col, target_df in [('SHOOT1 prob', shoot1_df), ('SHOOT2 prob', shoot2_df), ('SHOOT3 prob', shoot3_df)]:
-            probs = system_data[system_data[shoot_col] != 0][shoot_col]
-            probs = probs.dropna() # More robust way to remove NaN values
-            if len(probs) > 0:
-                prob_mean = np.mean(probs)
-                prob_sem = np.std(probs) / np.sqrt(len(probs)) if len(probs) > 1 else np.nan
-            else:
-                prob_mean = np.nan
-                prob_sem = np.nan
-            target_df.loc[simulation_type] = [prob_mean, prob_sem]
-
-        # --- Process Rate values ---
-        rates = system_data[system_data['rate'] != 0]['rate']
-        rates = rates.dropna() # More robust way to remove NaN values
-        if len(rates) > 0:
-            rate_mean = np.mean(rates)
-            rate_sem = np.std(rates) / np.sqrt(len(rates)) if len(rates) > 1 else np.nan
+    flux_df = stats_df.xs('inv_flux', axis=1, level=0).set_axis(columns, axis=1)
+    shoot1_df = stats_df.xs('SHOOT1 prob', axis=1, level=0).set_axis(columns, axis=1)
+    shoot2_df = stats_df.xs('SHOOT2 prob', axis=1, level=0).set_axis(columns, axis=1)
+    shoot3_df = stats_df.xs('SHOOT3 prob', axis=1, level=0).set_axis(columns, axis=1)
+    rate_df = stats_df.xs('rate', axis=1, level=0).set_axis(columns, axis=1)
+
+    def save_table(df, name):
+        """
+        Saves a result dataframe to output_dir in the selected format and returns its path.
+        """
+        save_path = output_dir / f"{name}.{fmt}"
+        if fmt == 'parquet':
+            df.to_parquet(save_path)
         else:
-            rate_mean = np.nan
-            rate_sem = np.nan
-        rate_df.loc[simulation_type] = [rate_mean, rate_sem]
+            df.to_csv(save_path)
+        return save_path
 
     # --- ADDED: Save the initial summary dataframes ---
-    flux_df.to_csv(output_dir / "flux_summary.csv")
-    shoot1_df.to_csv(output_dir / "shoot1_summary.csv")
-    shoot2_df.to_csv(output_dir / "shoot2_summary.csv")
-    shoot3_df.to_csv(output_dir / "shoot3_summary.csv")
-    rate_df.to_csv(output_dir / "rate_summary.csv")
+    save_table(flux_df, "flux_summary")
+    save_table(shoot1_df, "shoot1_summary")
+    save_table(shoot2_df, "shoot2_summary")
+    save_table(shoot3_df, "shoot3_summary")
+    save_table(rate_df, "rate_summary")
     print("Saved initial summary dataframes.")
     print('************************************************************')
 
@@ -99,39 +83,29 @@ def main(master_summary_path: Path, output_dir: Path, plots_dir: Path):
 
     base = ['at1', 'p1', 'gc3', 'gc5b', 'ev1']
 
-    # --- MODIFIED: Added a filename parameter to save the processed dataframe ---
-    def convert(df, title='', y_label='', filename=None):
+    # For each group, the simulation matching each 'base' simulation (None if absent)
+    matched_sims = {
+        group: [next((sim for sim in simulations if sim.startswith(sim_base)), None) for sim_base in base]
+        for group, simulations in groups.items()
+    }
+
+    # --- MODIFIED: Added a table_name parameter to save the processed dataframe ---
+    def convert(df, ax, title='', y_label='', table_name=None):
         """
-        Processes a dataframe for plotting and optionally saves it to a CSV file.
+        Processes a dataframe for plotting on the shared axes and optionally saves it to output_dir.
         """
-        # Create a new DataFrame with 'base' simulations as the index
-        new_df = pd.DataFrame(index=base)
-
-        # Iterate through the groups and fill in the corresponding columns
-        for group, simulations in groups.items():
-
-            mean_values = []
-            sem_values = []
-            for sim_base in base:
-                # Find the simulation that matches the base simulation
-                matched_sim = None
-                for sim in simulations:
-                    if sim.startswith(sim_base):
-                        matched_sim = sim
-                        break
-                if matched_sim and matched_sim in df.index:
-                    mean = df.loc[matched_sim, 'Mean']
-                    sem = df.loc[matched_sim, 'SEM']
-                else:
-                    mean = np.nan
-                    sem = np.nan
-                mean_values.append(mean)
-                sem_values.append(sem)
-            new_df[f'{group} Mean'] = mean_values
-            new_df[f'{group} SEM'] = sem_values
-
-        # Plotting
-        fig, ax = plt.subplots(figsize=(10, 6))
+        # Collect the columns of each group; unmatched or missing simulations become NaN
+        new_columns = {}
+        for group, sims in matched_sims.items():
+            group_df = df.reindex(sims)
+            new_columns[f'{group} Mean'] = group_df['Mean'].to_numpy()
+            new_columns[f'{group} SEM'] = group_df['SEM'].to_numpy()
+
+        # Create the new DataFrame in one go with 'base' simulations as the index
+        new_df = pd.DataFrame(new_columns, index=base)
+
+        # Plotting (the axes are reused between plots, so start from a blank one)
+        ax.clear()
         x = np.arange(len(base))  # Positions for the x-axis
         labels = base  # X-axis labels
 
@@ -167,16 +141,14 @@ def main(master_summary_path: Path, output_dir: Path, plots_dir: Path):
 
         plot_filename = title.replace(' ', '_').replace('/', '_') + ".png"
         plot_path = plots_dir / plot_filename
-        plt.savefig(plot_path)
-        plt.close(fig)
+        ax.figure.savefig(plot_path)
 
         # Display the resulting DataFrame
         print(new_df)
 
-        # --- ADDED: Save the processed dataframe if a filename is provided ---
-        if filename:
-            save_path = output_dir / filename
-            new_df.to_csv(save_path)
+        # --- ADDED: Save the processed dataframe if a table name is provided ---
+        if table_name:
+            save_path = save_table(new_df, table_name)
             print(f"Saved processed dataframe to {save_path}")
 
         return new_df
@@ -201,32 +173,38 @@ def main(master_summary_path: Path, output_dir: Path, plots_dir: Path):
     print(rate_df)
     print('************************************************************')
 
-    # --- MODIFIED: Calls to convert now include a filename for saving ---
+    # A single figure is shared by all the plots below
+    fig, ax = plt.subplots(figsize=(10, 6))
+
+    # --- MODIFIED: Calls to convert now include a table name for saving ---
     print('1/FLUX:')
-    flux_new_df = convert(flux_df, title='1/FLUX', y_label='1/FLUX Value', filename='flux_processed.csv')
+    flux_new_df = convert(flux_df, ax, title='1/FLUX', y_label='1/FLUX Value', table_name='flux_processed')
     print('************************************************************')
 
     print('Prob(Shoot1)')
-    shoot1_new_df = convert(shoot1_df, title='Probability of Success - SHOOT1', y_label='Probability', filename='shoot1_processed.csv')
+    shoot1_new_df = convert(shoot1_df, ax, title='Probability of Success - SHOOT1', y_label='Probability', table_name='shoot1_processed')
     print('************************************************************')
 
     print('Prob(Shoot2)')
-    shoot2_new_df = convert(shoot2_df, title='Probability of Success - SHOOT2', y_label='Probability', filename='shoot2_processed.csv')
+    shoot2_new_df = convert(shoot2_df, ax, title='Probability of Success - SHOOT2', y_label='Probability', table_name='shoot2_processed')
     print('************************************************************')
 
     print('Prob(Shoot3)')
-    shoot3_new_df = convert(shoot3_df, title='Probability of Success - SHOOT3', y_label='Probability', filename='shoot3_processed.csv')
+    shoot3_new_df = convert(shoot3_df, ax, title='Probability of Success - SHOOT3', y_label='Probability', table_name='shoot3_processed')
     print('************************************************************')
 
     print('Rate')
-    rate_new_df = convert(rate_df, title='Rate', y_label='Rate', filename='rate_processed.csv')
+    rate_new_df = convert(rate_df, ax, title='Rate', y_label='Rate', table_name='rate_processed')
+
+    plt.close(fig)
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Analyze simulation data and generate plots.")
     parser.add_argument("master_summary_path", type=Path, help="Path to the master simulation summary CSV file.")
     parser.add_argument("--output_dir", type=Path, default=Path("./analysis_results"), help="Directory to save analysis results.")
     parser.add_argument("--plots_dir", type=Path, default=Path("./plots"), help="Directory to save generated plots.")
+    parser.add_argument("--fmt", choices=["csv", "parquet"], default="csv", help="File format of the saved result tables (parquet requires pyarrow).")
     args = parser.parse_args()
 
-    main(args.master_summary_path, args.output_dir, args.plots_dir)
+    main(args.master_summary_path, args.output_dir, args.plots_dir, args.fmt)
 
@@ -1,4 +1,6 @@
+import numpy as np
 import pandas as pd
+from collections import defaultdict
 from pathlib import Path
 from summary import main as run_summary_analysis
 
@@ -12,7 +14,8 @@ def main():
         if d.is_dir() and d.name not in ["FFS_values", ".git", ".idea", "__pycache__"]
     ]
     
-    all_systems_data = []
+    # Column name -> list of per-case arrays, concatenated once at the end
+    all_systems_data = defaultdict(list)
 
     print(f"Found {len(case_dirs)} simulation cases to process.")
 
@@ -22,21 +25,18 @@ def main():
         print(f"{ '='*80}")
         
         # Run the modified summary script for each case
-        case_df = run_summary_analysis(case_path, output_base_dir)
+        case_data = run_summary_analysis(case_path, output_base_dir)
         
-        if case_df is not None:
-            case_df['System'] = case_path.name
-            all_systems_data.append(case_df)
+        if case_data is not None:
+            for col, values in case_data.items():
+                all_systems_data[col].append(values)
         else:
             print(f"[WARNING] No data returned for case: {case_path.name}")
 
     if all_systems_data:
-        # Combine all individual DataFrames into a master DataFrame
-        master_df = pd.concat(all_systems_data, ignore_index=True)
-        
-        # Reorder columns to have 'System' first
-        cols = ['System'] + [col for col in master_df.columns if col != 'System']
-        master_df = master_df[cols]
+        # Build the master DataFrame in one go, with 'System' as the first column
+        cols = ['System'] + [col for col in all_systems_data if col != 'System']
+        master_df = pd.DataFrame({col: np.concatenate(all_systems_data[col]) for col in cols})
 
         master_output_path = output_base_dir / "master_simulation_summary.csv"
         master_df.to_csv(master_output_path, index=False, float_format='%.6g')
@@ -11,9 +11,17 @@ The script is designed to be run from the command line, with the case directory
 and output directory specified as arguments.
 """
 
+import numpy as np
 import pandas as pd
 from pathlib import Path
-from typing import List, Dict, Tuple
+from typing import Dict, Tuple
+
+# Prefixes of the outcome lines in 'ffs.log', and the same prefixes preceded by a
+# newline for counting them directly in the raw bytes of the file
+SUCCESS_PREFIX = b"SUCCESS:"
+FAILURE_PREFIX = b"FAILURE:"
+SUCCESS_LINE = b"\n" + SUCCESS_PREFIX
+FAILURE_LINE = b"\n" + FAILURE_PREFIX
 
 def parse_flux_summary(file_path: Path) -> Tuple[int, float]:
     """
@@ -29,8 +37,7 @@ def parse_flux_summary(file_path: Path) -> Tuple[int, float]:
     if not file_path.is_file():
         return 0, 0.0
     
-    with open(file_path, 'r') as f:
-        lines = f.readlines()
+    lines = file_path.read_text().splitlines()
     
     flux_count = int(lines[0].split(':')[1].strip())
     flux_value = float(lines[1].split(':')[1].strip())
@@ -51,21 +58,21 @@ def analyze_ffs_log(file_path: Path) -> Tuple[int, int]:
     if not file_path.is_file():
         return 0, 0
         
-    success_count = 0
-    failure_count = 0
-    
-    with open(file_path, 'r') as f:
-        for line in f:
-            if line.startswith("SUCCESS:"):
-                success_count += 1
-            elif line.startswith("FAILURE:"):
-                failure_count += 1
+    # Count lines starting with each marker with a single byte scan of the whole file
+    data = file_path.read_bytes()
+    success_count = data.count(SUCCESS_LINE) + data.startswith(SUCCESS_PREFIX)
+    failure_count = data.count(FAILURE_LINE) + data.startswith(FAILURE_PREFIX)
                 
     return success_count, failure_count
 
 def main(case_path: Path, output_dir: Path):
     """
     Main function to analyze the synthetic dataset and reconstruct the summary table.
+
+    Returns:
+        Dict[str, np.ndarray]: The summary table as one array per column (one entry per
+                               run), plus a 'System' column holding the case name.
+                               Returns None if the case directory is not found.
     """
     # Define the number of canonical runs to process
     NUM_RUNS = 5
@@ -83,22 +90,32 @@ def main(case_path: Path, output_dir: Path):
     # Define the number of canonical runs to process
     NUM_RUNS = 5
 
-    all_runs_data: List[Dict] = []
+    shoot_stages = ['SHOOT1', 'SHOOT2', 'SHOOT3']
+
+    # Column-wise results, filled in place with one entry per run
+    run_columns: Dict[str, np.ndarray] = {
+        'Flux count': np.zeros(NUM_RUNS, dtype=np.int64),
+        'Flux value': np.zeros(NUM_RUNS, dtype=np.float64),
+    }
+    for stage in shoot_stages:
+        run_columns[f'{stage} success'] = np.zeros(NUM_RUNS, dtype=np.int64)
+        run_columns[f'{stage} total'] = np.zeros(NUM_RUNS, dtype=np.int64)
+        run_columns[f'{stage} prob'] = np.zeros(NUM_RUNS, dtype=np.float64)
+    run_columns['rate'] = np.zeros(NUM_RUNS, dtype=np.float64)
 
     # --- MAIN ANALYSIS LOOP ---
-    for i in range(1, NUM_RUNS + 1):
+    for run in range(NUM_RUNS):
+        i = run + 1
         print(f"\n--- Analyzing Canonical Run #{i} ---")
-        run_data = {}
 
         # 1. Process FLUX data
         flux_summary_path = case_path / f"FLUX/FLUX_{i}/flux_summary.txt"
         flux_count, flux_value = parse_flux_summary(flux_summary_path)
-        run_data['Flux count'] = flux_count
-        run_data['Flux value'] = flux_value
+        run_columns['Flux count'][run] = flux_count
+        run_columns['Flux value'][run] = flux_value
         print(f"  - FLUX: Found count={flux_count}, value={flux_value}")
 
         # 2. Process SHOOT stages
-        shoot_stages = ['SHOOT1', 'SHOOT2', 'SHOOT3']
         all_probs = []
         for stage in shoot_stages:
             log_path = case_path / f"{stage}/SHOOT_{i}/ffs.log"
@@ -106,9 +123,9 @@ def main(case_path: Path, output_dir: Path):
             total = success + failure
             prob = success / total if total > 0 else 0
             
-            run_data[f'{stage} success'] = success
-            run_data[f'{stage} total'] = total
-            run_data[f'{stage} prob'] = prob
+            run_columns[f'{stage} success'][run] = success
+            run_columns[f'{stage} total'][run] = total
+            run_columns[f'{stage} prob'][run] = prob
             all_probs.append(prob)
             print(f"  - {stage}: Found success={success}, total={total}, prob={prob:.6f}")
 
@@ -117,27 +134,12 @@ def main(case_path: Path, output_dir: Path):
         rate = (1 / flux_value) if flux_value != 0 else 0
         for p in all_probs:
             rate *= p
-        run_data['rate'] = rate
+        run_columns['rate'][run] = rate
         print(f"  - Calculated final rate: {rate:.2e}")
-        
-        all_runs_data.append(run_data)
 
     # 4. Create and save the final DataFrame
-    if not all_runs_data:
-        print("\n[ERROR] No data was processed. Exiting.")
-        return None
-
-    # Define the exact column order to match the original table
-    column_order = [
-        'Flux count', 'Flux value',
-        'SHOOT1 success', 'SHOOT1 total', 'SHOOT1 prob',
-        'SHOOT2 success', 'SHOOT2 total', 'SHOOT2 prob',
-        'SHOOT3 success', 'SHOOT3 total', 'SHOOT3 prob',
-        'rate'
-    ]
-    
-    final_df = pd.DataFrame(all_runs_data)
-    final_df = final_df[column_order] # Enforce column order
+    # The columns are already in the exact order of the original table
+    final_df = pd.DataFrame(run_columns)
 
     # Save to CSV
     output_csv_file = output_dir / f"{case_path.name}.csv"
@@ -149,7 +151,9 @@ def main(case_path: Path, output_dir: Path):
     print("="*60)
     print("\nFinal Reconstructed Table:")
     print(final_df.to_string())
-    return final_df
+
+    run_columns['System'] = np.repeat(case_path.name, NUM_RUNS)
+    return run_columns
 
 
 if __name__ == "__main__":
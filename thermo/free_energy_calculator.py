@@ -1,80 +1,235 @@
 import os
+import re
 import glob
+import warnings
 import numpy as np
+import pandas as pd
 import argparse
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+try:
+    from numba import njit
+except ImportError: # numba is optional; weights are then looked up with pandas
+    njit = None
+
+# Per-folder cache of the parsed -log(W) values
+CACHE_FILENAME = '.free_energy_cache.npz'
+# Bump whenever collect_neg_log_weights changes which frames or weights it keeps,
+# so caches written by older versions are rebuilt
+CACHE_VERSION = 3
+
+# Packed order parameter keys hold each of the 8 values in one byte
+OP_KEY_MAX = np.iinfo(np.uint8).max
 
 def log_sum_exp(x):
     """
     Numerically stable implementation of log-sum-exp.
     """
-    if not x:
+    # Ensure x is a numpy array for vectorized operations (no copy if it already is one)
+    x = np.asarray(x)
+    if x.size == 0:
         return -np.inf
-    # Ensure x is a numpy array for vectorized operations
-    x = np.array(x)
-    c = np.max(x)
-    return c + np.log(np.sum(np.exp(x - c)))
+    c = x.max()
+    return c + np.log(np.exp(x - c).sum())
 
-def calculate_free_energy_for_folder(base_folder):
+def fits_op_keys(op_values):
     """
-    Calculates the raw, volume-dependent free energy difference for a single 
-    simulation folder. Returns the delta_F value if successful, otherwise returns None.
+    Checks whether every order parameter value fits in the single byte of a packed key.
     """
-    neg_log_weights_A = []
-    neg_log_weights_B = []
-    
-    weights_map = {}
-    wfile_path = os.path.join(base_folder, 'wfile.dat')
-    if not os.path.exists(wfile_path):
-        return None # Cannot proceed without weights
+    return op_values.size == 0 or (op_values.min() >= 0 and op_values.max() <= OP_KEY_MAX)
+
+def pack_op_keys(op_values):
+    """
+    Packs each row of an (N, 8) array of order parameters into a single uint64 key
+    by narrowing the values to one byte each and viewing the row as one 64-bit word.
+    """
+    return np.ascontiguousarray(op_values, dtype=np.uint8).view(np.uint64).ravel()
+
+if njit is not None:
+    @njit(cache=True)
+    def split_neg_log_weights(op_keys, op4_values, sorted_weight_keys, sorted_log_weights):
+        """
+        Looks up the log weight of every frame by binary search and returns the
+        -log(W) values of the frames in state A (rho_4 = 0) and state B (rho_4 > 1).
+        Frames without a weight are skipped.
+        """
+        n_frames = op_keys.shape[0]
+        n_weights = sorted_weight_keys.shape[0]
+        neg_log_weights_A = np.empty(n_frames)
+        neg_log_weights_B = np.empty(n_frames)
+        n_A = 0
+        n_B = 0
+        for i in range(n_frames):
+            op4 = op4_values[i]
+            if op4 == 1:
+                continue
+            j = np.searchsorted(sorted_weight_keys, op_keys[i])
+            if j == n_weights or sorted_weight_keys[j] != op_keys[i]:
+                continue
+            if op4 == 0:
+                neg_log_weights_A[n_A] = -sorted_log_weights[j]
+                n_A += 1
+            elif op4 > 1:
+                neg_log_weights_B[n_B] = -sorted_log_weights[j]
+                n_B += 1
+        return neg_log_weights_A[:n_A], neg_log_weights_B[:n_B]
+
+def whole_number_rows(values):
+    """
+    Flags the rows of a 2D float array whose values are all finite whole numbers.
+    """
+    return (np.isfinite(values) & (values == np.trunc(values))).all(axis=1)
+
+def collect_neg_log_weights(wfile_path, energy_files):
+    """
+    Parses the weights file and the energy files of a folder and returns the -log(W)
+    values of all frames in state A and in state B, or None if the weights are unreadable.
+    """
+    # Per-file arrays of -log(W) for frames in state A and state B
+    neg_log_weight_parts_A = []
+    neg_log_weight_parts_B = []
     
     try:
-        with open(wfile_path, 'r') as f:
-            for line in f:
-                parts = line.strip().split()
-                if len(parts) == 9:
-                    op_key = tuple(int(p) for p in parts[0:8])
-                    weight_W = float(parts[8])
-                    if weight_W > 0:
-                        weights_map[op_key] = np.log(weight_W)
-                    else:
-                        weights_map[op_key] = -np.inf
+        # 8 integer order parameters followed by the weight W, read as strings; a tenth
+        # column is read only to detect lines with extra fields, which are either skipped
+        # by the parser or truncated (with a ParserWarning) and then dropped below
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore', pd.errors.ParserWarning)
+            wfile_df = pd.read_csv(
+                wfile_path, sep=r'\s+', header=None, names=range(10), index_col=False,
+                on_bad_lines='skip', dtype=str, keep_default_na=False, engine='c'
+            )
+
+        # Only lines with exactly 9 fields are weight entries (missing fields are '')
+        field_present = wfile_df != ''
+        wfile_df = wfile_df[field_present.iloc[:, :9].all(axis=1) & ~field_present[9]]
+
+        # Converting the strings has the semantics of int() and float(), so any
+        # malformed entry invalidates the whole weights file
+        weight_keys = wfile_df.iloc[:, :8].astype(np.int64)
+        weight_W = wfile_df[8].astype(np.float64)
     except Exception as e:
         print(f"  Warning: Error reading weights file {wfile_path}: {e}")
         return None
 
-    energy_files_to_process = []
-    for dirpath, _, filenames in os.walk(base_folder):
-        for filename in filenames:
-            if filename == 'energy.dat':
-                energy_files_to_process.append(os.path.join(dirpath, filename))
+    # log(W) indexed by the order parameter tuple (the last entry wins for repeated tuples)
+    last_entries = ~weight_keys.duplicated(keep='last').to_numpy()
+    weight_keys = weight_keys.to_numpy()[last_entries]
+    weight_W = weight_W.to_numpy()[last_entries]
+    log_weight_W = np.full(weight_W.shape, -np.inf)
+    np.log(weight_W, out=log_weight_W, where=weight_W > 0)
+    weights_series = pd.Series(log_weight_W, index=pd.MultiIndex.from_arrays(weight_keys.T))
 
-    if not energy_files_to_process:
-        return None
-        
-    for file_path in energy_files_to_process:
+    # With numba, frames are looked up in a compiled loop over sorted packed keys
+    use_packed_keys = njit is not None and fits_op_keys(weight_keys)
+    if use_packed_keys:
+        packed_weight_keys = pack_op_keys(weight_keys)
+        key_order = np.argsort(packed_weight_keys)
+        sorted_weight_keys = packed_weight_keys[key_order]
+        sorted_log_weights = log_weight_W[key_order]
+
+    for file_path in energy_files:
         try:
-            with open(file_path, 'r') as f:
-                for line in f:
-                    columns = line.strip().split()
-                    if len(columns) >= 13:
-                        try:
-                            op_values = tuple(int(c) for c in columns[5:13])
-                            op4_value = int(columns[8])
-                            log_weight = weights_map.get(op_values)
-
-                            if log_weight is not None:
-                                neg_log_weight = -log_weight
-                                if op4_value == 0:
-                                    neg_log_weights_A.append(neg_log_weight)
-                                elif op4_value > 1:
-                                    neg_log_weights_B.append(neg_log_weight)
-                        except (ValueError, IndexError):
-                            pass
+            # Columns 5-12 hold the 8 order parameters; short lines are padded with NaN
+            # and any fields beyond the 13th are ignored
+            energy_df = pd.read_csv(
+                file_path, sep=r'\s+', header=None, names=range(13), index_col=False,
+                usecols=range(5, 13), engine='c'
+            )
+        except pd.errors.EmptyDataError:
+            continue
         except Exception as e:
             print(f"  Warning: Error reading energy file {file_path}: {e}")
             continue
 
-    if not neg_log_weights_A or not neg_log_weights_B:
+        # Rows with missing or non-integer order parameters are skipped
+        op_values = energy_df.apply(pd.to_numeric, errors='coerce').to_numpy(dtype=np.float64)
+        op_values = op_values[whole_number_rows(op_values)].astype(np.int64)
+
+        if len(op_values) == 0:
+            continue
+
+        op4_values = op_values[:, 3]
+        if use_packed_keys and fits_op_keys(op_values):
+            neg_log_weights_A, neg_log_weights_B = split_neg_log_weights(
+                pack_op_keys(op_values), op4_values, sorted_weight_keys, sorted_log_weights
+            )
+        else:
+            # Look up every row's weight; rows without a weight (NaN) are ignored
+            log_weight = weights_series.reindex(pd.MultiIndex.from_arrays(op_values.T)).to_numpy()
+            found = ~np.isnan(log_weight)
+            neg_log_weight = -log_weight
+            neg_log_weights_A = neg_log_weight[found & (op4_values == 0)]
+            neg_log_weights_B = neg_log_weight[found & (op4_values > 1)]
+
+        neg_log_weight_parts_A.append(neg_log_weights_A)
+        neg_log_weight_parts_B.append(neg_log_weights_B)
+
+    neg_log_weights_A = np.concatenate(neg_log_weight_parts_A) if neg_log_weight_parts_A else np.empty(0)
+    neg_log_weights_B = np.concatenate(neg_log_weight_parts_B) if neg_log_weight_parts_B else np.empty(0)
+
+    return neg_log_weights_A, neg_log_weights_B
+
+def input_signature(base_folder, file_paths):
+    """
+    Describes the current state of a folder's input files by their relative paths,
+    modification times and sizes, together with the cache format version.
+    """
+    stats = [os.stat(file_path) for file_path in file_paths]
+    return {
+        'version': np.array(CACHE_VERSION),
+        'paths': np.array([os.path.relpath(file_path, base_folder) for file_path in file_paths]),
+        'stats': np.array([[st.st_mtime_ns, st.st_size] for st in stats], dtype=np.int64),
+    }
+
+def load_cached_weights(cache_path, signature):
+    """
+    Returns the cached (neg_log_weights_A, neg_log_weights_B) if the cache file was
+    written for input files matching the signature, otherwise None.
+    """
+    if not os.path.exists(cache_path):
+        return None
+    try:
+        with np.load(cache_path) as cache:
+            if all(np.array_equal(cache[key], value) for key, value in signature.items()):
+                return cache['neg_log_weights_A'], cache['neg_log_weights_B']
+    except Exception:
+        pass # An unreadable cache is simply rebuilt
+    return None
+
+def calculate_free_energy_for_folder(base_folder):
+    """
+    Calculates the raw, volume-dependent free energy difference for a single 
+    simulation folder. Returns the delta_F value if successful, otherwise returns None.
+    """
+    wfile_path = os.path.join(base_folder, 'wfile.dat')
+    if not os.path.exists(wfile_path):
+        return None # Cannot proceed without weights
+
+    energy_files_to_process = sorted(Path(base_folder).rglob('energy.dat'))
+
+    if not energy_files_to_process:
+        return None
+
+    # Parsed weights are cached next to the data and reused while the inputs are unchanged
+    cache_path = os.path.join(base_folder, CACHE_FILENAME)
+    signature = input_signature(base_folder, [wfile_path] + energy_files_to_process)
+    cached_weights = load_cached_weights(cache_path, signature)
+    if cached_weights is not None:
+        neg_log_weights_A, neg_log_weights_B = cached_weights
+    else:
+        collected_weights = collect_neg_log_weights(wfile_path, energy_files_to_process)
+        if collected_weights is None:
+            return None
+        neg_log_weights_A, neg_log_weights_B = collected_weights
+        try:
+            np.savez(cache_path, neg_log_weights_A=neg_log_weights_A, neg_log_weights_B=neg_log_weights_B, **signature)
+        except OSError as e:
+            print(f"  Warning: Could not write cache file {cache_path}: {e}")
+
+    if neg_log_weights_A.size == 0 or neg_log_weights_B.size == 0:
         return None # A state was not observed in this folder
 
     log_total_prob_A = log_sum_exp(neg_log_weights_A)
@@ -84,6 +239,16 @@ def calculate_free_energy_for_folder(base_folder):
     return -(log_total_prob_B - log_total_prob_A)
 
 
+def compile_folder_pattern(rules):
+    """
+    Compiles the folder rules of an analysis set into one regex matching folder names
+    that contain rules['contains'] but neither rules['not_contains'] (if given) nor 'hyb'.
+    """
+    excluded = ['hyb'] + ([rules['not_contains']] if 'not_contains' in rules else [])
+    lookaheads = ''.join(f"(?!.*{re.escape(substring)})" for substring in excluded)
+    return re.compile(f"{lookaheads}.*{re.escape(rules['contains'])}")
+
+
 def main(base_path: str):
     """
     Main function to find, analyze, correct, and average different sets of simulations.
@@ -102,57 +267,63 @@ def main(base_path: str):
 
     all_folders_in_path = glob.glob(os.path.join(base_path, 'bub_*'))
 
-    for set_name, rules in analysis_sets.items():
-        print("\n" + "#"*60)
-        print(f"### Preparing analysis for set: '{set_name.upper()}' ###")
+    # Assign the folders to every set whose rules they match, in a single pass
+    folder_patterns = {set_name: compile_folder_pattern(rules) for set_name, rules in analysis_sets.items()}
+    folders_by_set = defaultdict(list)
+    for folder in all_folders_in_path:
+        folder_name = os.path.basename(folder)
+        for set_name, pattern in folder_patterns.items():
+            if pattern.match(folder_name):
+                folders_by_set[set_name].append(folder)
+
+    with ProcessPoolExecutor() as executor:
+        for set_name, rules in analysis_sets.items():
+            print("\n" + "#"*60)
+            print(f"### Preparing analysis for set: '{set_name.upper()}' ###")
         
-        # --- Volume Correction Setup ---
-        sim_box_side = rules['box_side']
-        V_SIM = sim_box_side**3
-        volume_correction = np.log(V_REF / V_SIM)
-        print(f"Reference box: {REF_BOX_SIDE}^3. This set's box: {sim_box_side}^3.")
-        print(f"Applying correction term ln(V_ref/V_sim) = {volume_correction:.4f} to dF/kT.")
+            # --- Volume Correction Setup ---
+            sim_box_side = rules['box_side']
+            V_SIM = sim_box_side**3
+            volume_correction = np.log(V_REF / V_SIM)
+            print(f"Reference box: {REF_BOX_SIDE}^3. This set's box: {sim_box_side}^3.")
+            print(f"Applying correction term ln(V_ref/V_sim) = {volume_correction:.4f} to dF/kT.")
         
-        filtered_folders = []
-        for folder in all_folders_in_path:
-            folder_name = os.path.basename(folder)
-            if 'hyb' in folder_name: continue
-            if rules['contains'] not in folder_name: continue
-            if 'not_contains' in rules and rules['not_contains'] in folder_name: continue
-            filtered_folders.append(folder)
+            filtered_folders = folders_by_set[set_name]
             
-        print(f"Found {len(filtered_folders)} potential folders for this set.")
+            print(f"Found {len(filtered_folders)} potential folders for this set.")
         
-        corrected_delta_F_values = []
-        print("Analyzing individual folders...")
-        for folder in sorted(filtered_folders):
-            folder_name = os.path.basename(folder)
-            raw_delta_F = calculate_free_energy_for_folder(folder)
+            corrected_delta_F_values = []
+            print("Analyzing individual folders...")
+            # Folders are independent, so they are analysed in parallel worker processes
+            sorted_folders = sorted(filtered_folders)
+            raw_delta_F_values = executor.map(calculate_free_energy_for_folder, sorted_folders)
+            for folder, raw_delta_F in zip(sorted_folders, raw_delta_F_values):
+                folder_name = os.path.basename(folder)
             
-            if raw_delta_F is not None and np.isfinite(raw_delta_F):
-                corrected_delta_F = raw_delta_F + volume_correction
-                corrected_delta_F_values.append(corrected_delta_F)
-                print(f"  - OK: {folder_name:<12} -> Raw dF/kT = {raw_delta_F:8.4f}, Corrected dF/kT = {corrected_delta_F:8.4f}")
+                if raw_delta_F is not None and np.isfinite(raw_delta_F):
+                    corrected_delta_F = raw_delta_F + volume_correction
+                    corrected_delta_F_values.append(corrected_delta_F)
+                    print(f"  - OK: {folder_name:<12} -> Raw dF/kT = {raw_delta_F:8.4f}, Corrected dF/kT = {corrected_delta_F:8.4f}")
+                else:
+                    print(f"  - SKIPPED: {folder_name} (Did not sample both states A and B)")
+
+            print("\n" + "="*60)
+            print(f"Final Standardized Result for Set: '{set_name.upper()}'")
+            print("="*60)
+
+            if not corrected_delta_F_values:
+                print("No valid folders found to calculate a final average.")
+            elif len(corrected_delta_F_values) == 1:
+                print(f"Only one valid folder was found. Cannot calculate SEM.")
+                print(f"  -> Standardized Free Energy (ΔF/kT) = {corrected_delta_F_values[0]:.4f}")
+                print(f"  (Based on 1 folder)")
             else:
-                print(f"  - SKIPPED: {folder_name} (Did not sample both states A and B)")
-
-        print("\n" + "="*60)
-        print(f"Final Standardized Result for Set: '{set_name.upper()}'")
-        print("="*60)
-
-        if not corrected_delta_F_values:
-            print("No valid folders found to calculate a final average.")
-        elif len(corrected_delta_F_values) == 1:
-            print(f"Only one valid folder was found. Cannot calculate SEM.")
-            print(f"  -> Standardized Free Energy (ΔF/kT) = {corrected_delta_F_values[0]:.4f}")
-            print(f"  (Based on 1 folder)")
-        else:
-            mean_delta_F = np.mean(corrected_delta_F_values)
-            std_dev = np.std(corrected_delta_F_values, ddof=1)
-            sem = std_dev / np.sqrt(len(corrected_delta_F_values))
+                mean_delta_F = np.mean(corrected_delta_F_values)
+                std_dev = np.std(corrected_delta_F_values, ddof=1)
+                sem = std_dev / np.sqrt(len(corrected_delta_F_values))
             
-            print(f"  -> Standardized Free Energy (ΔF/kT) = {mean_delta_F:.4f} ± {sem:.4f}")
-            print(f"  (Calculated from {len(corrected_delta_F_values)} of {len(filtered_folders)} folders)")
+                print(f"  -> Standardized Free Energy (ΔF/kT) = {mean_delta_F:.4f} ± {sem:.4f}")
+                print(f"  (Calculated from {len(corrected_delta_F_values)} of {len(filtered_folders)} folders)")
 
     print("\n" + "#"*60)
     print("### All analysis sets complete. ###")